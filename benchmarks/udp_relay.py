@@ -0,0 +1,114 @@
+"""UDP relay benchmark
+
+Measure UDP ASSOCIATE relay throughput on loopback, usage:
+
+    python benchmarks/udp_relay.py [--count 20000] [--window 32] [--size 64]
+"""
+from time import perf_counter, sleep
+from struct import pack
+from socket import (
+    AF_INET,
+    SOCK_DGRAM,
+    socket,
+    timeout,
+    inet_aton,
+    create_connection,
+)
+from argparse import ArgumentParser
+from threading import Event, Thread
+from procksy.proxy import Procksy
+from procksy.config import ProcksyConfig
+
+
+BIND_ADDR = '127.0.0.1'
+
+
+def _udp_echo_server() -> int:
+    sock = socket(AF_INET, SOCK_DGRAM)
+    sock.bind((BIND_ADDR, 0))
+
+    def _serve():
+        while True:
+            data, peer_name = sock.recvfrom(65535)
+            sock.sendto(data, peer_name)
+
+    Thread(target=_serve, daemon=True).start()
+    return sock.getsockname()[1]
+
+
+def _start_procksy(port: int) -> Event:
+    config = ProcksyConfig.from_dict(
+        {
+            'client_filter': {'mode': 'none'},
+            'target_filter': {'mode': 'none'},
+            'authenticator': {'enabled': False, 'users': {}},
+            'bind_addr': BIND_ADDR,
+            'bind_port': port,
+        }
+    )
+    term_evt = Event()
+    procksy = Procksy(config=config, term_evt=term_evt)
+    Thread(target=procksy.serve, daemon=True).start()
+    sleep(0.5)
+    return term_evt
+
+
+def _associate(port: int):
+    client_sock = create_connection((BIND_ADDR, port))
+    client_sock.sendall(b'\x05\x01\x00')
+    client_sock.recv(2)
+    client_sock.sendall(b'\x05\x03\x00\x01\x00\x00\x00\x00\x00\x00')
+    reply = client_sock.recv(10)
+    if reply[1] != 0:
+        raise RuntimeError(f"udp associate failed: {reply[1]}")
+    return client_sock, (BIND_ADDR, int.from_bytes(reply[8:10], 'big'))
+
+
+def _parse_args():
+    parser = ArgumentParser(description="UDP relay benchmark")
+    parser.add_argument('--port', type=int, default=19050, help="Bind port")
+    parser.add_argument(
+        '--count', type=int, default=20000, help="Datagrams to send"
+    )
+    parser.add_argument(
+        '--window', type=int, default=32, help="Datagrams in flight"
+    )
+    parser.add_argument('--size', type=int, default=64, help="Payload size")
+    return parser.parse_args()
+
+
+def app():
+    """Benchmark entrypoint"""
+    args = _parse_args()
+    echo_port = _udp_echo_server()
+    term_evt = _start_procksy(args.port)
+    client_sock, relay = _associate(args.port)
+    udp_sock = socket(AF_INET, SOCK_DGRAM)
+    udp_sock.settimeout(1)
+    datagram = (
+        b'\x00\x00\x00\x01'
+        + inet_aton(BIND_ADDR)
+        + pack('!H', echo_port)
+        + b'x' * args.size
+    )
+    sent = received = lost = 0
+    start = perf_counter()
+    while received + lost < args.count:
+        while sent - received - lost < args.window and sent < args.count:
+            udp_sock.sendto(datagram, relay)
+            sent += 1
+        try:
+            udp_sock.recvfrom(65535)
+            received += 1
+        except timeout:
+            lost += sent - received - lost
+    elapsed = perf_counter() - start
+    print(f"round trips: {received} lost: {lost} elapsed: {elapsed:.3f}s")
+    print(f"round trips/s: {received / elapsed:.0f}")
+    print(f"relayed datagrams/s: {2 * received / elapsed:.0f}")
+    client_sock.close()
+    term_evt.set()
+
+
+if __name__ == '__main__':
+    app()
@@ -8,30 +8,69 @@ from argon2.exceptions import (
     VerificationError,
     VerifyMismatchError,
 )
+from .filter import Filter, FilterMode
 from .logging import LOGGER
 
 
 PASSWORD_HASHER = PasswordHasher()
 
 
+# fail closed when user references an unknown policy
+DENY_ALL_POLICY = Filter(mode=FilterMode.ALLOW)
+
+
+def _compile_policies(
+    dct, policies: t.Mapping[str, Filter]
+) -> t.Mapping[bytes, Filter]:
+    """Map users to target filters, shared by users of the same policy"""
+    user_policies = {}
+    for user, value in dct['users'].items():
+        if not isinstance(value, dict) or 'policy' not in value:
+            continue
+        policy = policies.get(value['policy'])
+        if policy is None:
+            LOGGER.error(
+                "unknown policy %s for user %s", value['policy'], user
+            )
+            policy = DENY_ALL_POLICY
+        user_policies[user.encode('utf-8')] = policy
+    return user_policies
+
+
 @dataclass
 class Authenticator:
     """Filter object"""
 
     enabled: bool = False
     users: t.Mapping[bytes, str] = field(default_factory=dict)
+    named_policies: t.Mapping[str, Filter] = field(default_factory=dict)
+    policies: t.Mapping[bytes, Filter] = field(default_factory=dict)
 
     @classmethod
     def from_dict(cls, dct):
         """Build instance from dict"""
+        named_policies = {
+            name: Filter.from_dict(policy)
+            for name, policy in dct.get('policies', {}).items()
+        }
         return cls(
             enabled=dct['enabled'],
             users={
-                user.encode('utf-8'): digest
-                for user, digest in dct['users'].items()
+                user.encode('utf-8'): (
+                    value['digest'] if isinstance(value, dict) else value
+                )
+                for user, value in dct['users'].items()
             },
+            named_policies=named_policies,
+            policies=_compile_policies(dct, named_policies),
         )
 
+    def policy(self, user: t.Optional[bytes]) -> t.Optional[Filter]:
+        """Target filter of given authenticated user, None if unset"""
+        if user is None:
+            return None
+        return self.policies.get(user)
+
     def is_allowed(self, user: bytes, secret: bytes) -> bool:
         """Determine if candidate is filtered based on filter mode and values"""
         digest = self.users.get(user)
@@ -0,0 +1,148 @@
+"""Circuit breaker module
+"""
+import typing as t
+from collections import OrderedDict
+from time import monotonic
+from socket import gaierror, timeout as SocketTimeout
+from errno import EHOSTUNREACH, ENETUNREACH
+from threading import Lock, Thread
+from dataclasses import dataclass, field
+from .socket import connect_error, create_socket
+from .logging import LOGGER
+from .protocol import (
+    RESPONSE_SERVER_FAILURE,
+    RESPONSE_HOST_UNREACHABLE,
+    RESPONSE_CONNECTION_REFUSED,
+    RESPONSE_NETWORK_UNREACHABLE,
+)
+
+
+DEFAULT_THRESHOLD = 5
+DEFAULT_COOLDOWN = 30
+MAX_CIRCUITS = 4096
+
+
+def response_for_error(error: OSError) -> str:
+    """Map connect error to server reply response"""
+    if isinstance(error, ConnectionRefusedError):
+        return RESPONSE_CONNECTION_REFUSED
+    if isinstance(error, (SocketTimeout, gaierror)):
+        return RESPONSE_HOST_UNREACHABLE
+    if error.errno == EHOSTUNREACH:
+        return RESPONSE_HOST_UNREACHABLE
+    if error.errno == ENETUNREACH:
+        return RESPONSE_NETWORK_UNREACHABLE
+    return RESPONSE_SERVER_FAILURE
+
+
+def _key(target) -> t.Tuple[str, int]:
+    """Circuit key of target, hostnames are case insensitive"""
+    dest_addr, dest_port = target
+    return dest_addr.lower(), dest_port
+
+
+@dataclass
+class Circuit:
+    """Connect failures state of a target"""
+
+    failures: int = 0
+    response: str = RESPONSE_SERVER_FAILURE
+    opened_at: t.Optional[float] = None
+    probing: bool = False
+
+
+@dataclass
+class CircuitBreaker:
+    """Fail fast on targets which repeatedly failed to connect"""
+
+    threshold: int = DEFAULT_THRESHOLD
+    cooldown: int = DEFAULT_COOLDOWN
+    # least recently failed first, oldest evicted past MAX_CIRCUITS
+    _circuits: t.MutableMapping[t.Tuple[str, int], Circuit] = field(
+        default_factory=OrderedDict, repr=False
+    )
+    _lock: Lock = field(default_factory=Lock, repr=False)
+
+    @classmethod
+    def from_dict(cls, dct):
+        """Build instance from dict"""
+        return cls(
+            threshold=dct.get('threshold', DEFAULT_THRESHOLD),
+            cooldown=dct.get('cooldown', DEFAULT_COOLDOWN),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """Determine if circuit breaker is enabled"""
+        return self.threshold > 0
+
+    def check(self, target, sock_timeout: int) -> t.Optional[str]:
+        """Response to fail fast with when target circuit is open"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            circuit = self._circuits.get(_key(target))
+            if not circuit or circuit.opened_at is None:
+                return None
+            if (
+                not circuit.probing
+                and monotonic() - circuit.opened_at > self.cooldown
+            ):
+                circuit.probing = True
+                Thread(
+                    target=self._probe,
+                    args=(target, sock_timeout),
+                    daemon=True,
+                ).start()
+            return circuit.response
+
+    def record_success(self, target):
+        """Close target circuit"""
+        if not self.enabled:
+            return
+        with self._lock:
+            circuit = self._circuits.pop(_key(target), None)
+        if circuit and circuit.opened_at is not None:
+            LOGGER.info("action=circuit_closed target=%s", target)
+
+    def record_failure(self, target, response: str):
+        """Count a connect failure and open target circuit past threshold"""
+        if not self.enabled:
+            return
+        key = _key(target)
+        with self._lock:
+            circuit = self._circuits.get(key)
+            if circuit:
+                self._circuits.move_to_end(key)
+            else:
+                if len(self._circuits) >= MAX_CIRCUITS:
+                    self._circuits.popitem(last=False)
+                circuit = self._circuits[key] = Circuit()
+            circuit.failures += 1
+            circuit.response = response
+            if (
+                circuit.opened_at is not None
+                or circuit.failures < self.threshold
+            ):
+                return
+            circuit.opened_at = monotonic()
+        LOGGER.warning(
+            "action=circuit_opened target=%s response=%s", target, response
+        )
+
+    def _probe(self, target, sock_timeout: int):
+        sock = create_socket(sock_timeout)
+        error = connect_error(sock, target) if sock else None
+        if sock:
+            sock.close()
+        if sock and error is None:
+            self.record_success(target)
+            return
+        with self._lock:
+            circuit = self._circuits.get(_key(target))
+            if not circuit:
+                return
+            circuit.opened_at = monotonic()
+            circuit.probing = False
+            if error:
+                circuit.response = response_for_error(error)
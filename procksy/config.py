@@ -4,7 +4,11 @@ from json import JSONDecodeError, loads
 from pathlib import Path
 from dataclasses import dataclass, field
 from .filter import Filter
+from .socket import SocketOptions
 from .logging import LOGGER
+from .tls import TLSConfig
+from .breaker import CircuitBreaker
+from .upstream import UpstreamPool
 from .authenticator import Authenticator
 
 FILENAME = 'procksy.json'
@@ -18,6 +22,8 @@ DEFAULT_BIND_PORT = 9050
 DEFAULT_BUFFER_SIZE = 2048
 DEFAULT_MAX_THREADS = 200
 DEFAULT_SOCK_TIMEOUT = 5
+DEFAULT_DRAIN_TIMEOUT = 30
+DEFAULT_UDP_IDLE_TIMEOUT = 60
 
 
 @dataclass
@@ -27,26 +33,51 @@ class ProcksyConfig:
     client_filter: Filter = field(default_factory=Filter)
     target_filter: Filter = field(default_factory=Filter)
     authenticator: Authenticator = field(default_factory=Authenticator)
+    upstreams: UpstreamPool = field(default_factory=UpstreamPool)
+    circuit_breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+    client_socket_options: SocketOptions = field(default_factory=SocketOptions)
+    upstream_socket_options: SocketOptions = field(
+        default_factory=SocketOptions
+    )
+    tls: TLSConfig = field(default_factory=TLSConfig)
     bind_addr: str = DEFAULT_BIND_ADDR
     bind_port: int = DEFAULT_BIND_PORT
     buffer_size: int = DEFAULT_BUFFER_SIZE
     max_threads: int = DEFAULT_MAX_THREADS
     sock_timeout: int = DEFAULT_SOCK_TIMEOUT
+    drain_timeout: int = DEFAULT_DRAIN_TIMEOUT
+    udp_idle_timeout: int = DEFAULT_UDP_IDLE_TIMEOUT
 
     @classmethod
     def from_dict(cls, dct) -> 'ProcksyConfig':
         """Build instance from dict"""
+        socket_options = dct.get('socket_options', {})
         return cls(
             client_filter=Filter.from_dict(dct.get('client_filter', {})),
             target_filter=Filter.from_dict(dct.get('target_filter', {})),
             authenticator=Authenticator.from_dict(
                 dct.get('authenticator', {})
             ),
+            upstreams=UpstreamPool.from_dict(dct.get('upstreams', {})),
+            circuit_breaker=CircuitBreaker.from_dict(
+                dct.get('circuit_breaker', {})
+            ),
+            client_socket_options=SocketOptions.from_dict(
+                socket_options.get('client', {})
+            ),
+            upstream_socket_options=SocketOptions.from_dict(
+                socket_options.get('upstream', {})
+            ),
+            tls=TLSConfig.from_dict(dct.get('tls', {})),
             bind_addr=dct.get('bind_addr', DEFAULT_BIND_ADDR),
             bind_port=dct.get('bind_port', DEFAULT_BIND_PORT),
             buffer_size=dct.get('buffer_size', DEFAULT_BUFFER_SIZE),
             max_threads=dct.get('max_threads', DEFAULT_MAX_THREADS),
             sock_timeout=dct.get('sock_timeout', DEFAULT_SOCK_TIMEOUT),
+            drain_timeout=dct.get('drain_timeout', DEFAULT_DRAIN_TIMEOUT),
+            udp_idle_timeout=dct.get(
+                'udp_idle_timeout', DEFAULT_UDP_IDLE_TIMEOUT
+            ),
         )
 
     @classmethod
@@ -105,3 +136,5 @@ class ProcksyConfig:
         self.buffer_size = args.buffer_size or self.buffer_size
         self.max_threads = args.max_threads or self.max_threads
         self.sock_timeout = args.sock_timeout or self.sock_timeout
+        self.drain_timeout = args.drain_timeout or self.drain_timeout
+        self.udp_idle_timeout = args.udp_idle_timeout or self.udp_idle_timeout
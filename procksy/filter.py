@@ -1,8 +1,10 @@
 """Filter module
 """
+import re
 import typing as t
 from enum import Enum
 from pathlib import Path
+from functools import lru_cache
 from dataclasses import dataclass, field
 from .logging import LOGGER
 
@@ -16,6 +18,8 @@ class FilterMode(Enum):
 
 
 DEFAULT_FILTER_MODE = FilterMode.NONE
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_PATTERN_FLAGS = re.compile('').flags
 
 
 def _items_from_list(lst: t.List[str]):
@@ -32,29 +36,123 @@ def _items_from_filepath(filepath: Path):
             yield line.strip().lower()
 
 
+def _compile_patterns(lst: t.List[str]) -> t.Tuple[t.Pattern, ...]:
+    """Compile patterns, joining those safe to combine in one alternation
+
+    Patterns using groups (hence backreferences) or global inline flags
+    would change meaning or fail once joined, they are kept separate.
+    """
+    combinable = []
+    separate = []
+    for pattern in lst:
+        try:
+            inline = re.compile(pattern)
+            compiled = re.compile(pattern, re.IGNORECASE)
+        except re.error:
+            LOGGER.exception("ignored, invalid pattern: %s", pattern)
+            continue
+        if inline.groups or inline.flags != DEFAULT_PATTERN_FLAGS:
+            separate.append(compiled)
+            continue
+        combinable.append(compiled)
+    if len(combinable) > 1:
+        try:
+            combinable = [
+                re.compile(
+                    '|'.join(f'(?:{item.pattern})' for item in combinable),
+                    re.IGNORECASE,
+                )
+            ]
+        except re.error:
+            LOGGER.exception("failed to combine patterns")
+    return tuple(combinable + separate)
+
+
+def _port_range(value: str) -> t.Optional[t.Tuple[str, int, int]]:
+    """Split host:low-high value, None if value is not a port range"""
+    host, sep, ports = value.rpartition(':')
+    low, sep_range, high = ports.partition('-')
+    if not sep or not sep_range or not low.isdigit() or not high.isdigit():
+        return None
+    return host, int(low), int(high)
+
+
 @dataclass
 class Filter:
     """Filter object"""
 
     mode: FilterMode = DEFAULT_FILTER_MODE
     values: t.Set[str] = field(default_factory=set)
+    ranges: t.Mapping[str, t.Tuple[t.Tuple[int, int], ...]] = field(
+        default_factory=dict
+    )
+    patterns: t.Tuple[t.Pattern, ...] = ()
+    cache_size: int = DEFAULT_CACHE_SIZE
+    _cached_decide: t.Optional[t.Callable] = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def __post_init__(self):
+        if self.patterns:
+            self._cached_decide = lru_cache(maxsize=self.cache_size)(
+                self._decide
+            )
 
     @classmethod
     def from_dict(cls, dct):
         """Build instance from dict"""
-        values = set()
+        items = set()
         if 'values' in dct and dct['values']:
-            values.update(list(_items_from_list(dct['values'])))
+            items.update(list(_items_from_list(dct['values'])))
         if 'filepath' in dct and dct['filepath']:
-            values.update(list(_items_from_filepath(Path(dct['filepath']))))
-        return cls(mode=FilterMode(dct['mode']), values=values)
+            items.update(list(_items_from_filepath(Path(dct['filepath']))))
+        values = set()
+        ranges = {}
+        for item in items:
+            port_range = _port_range(item)
+            if port_range is None:
+                values.add(item)
+                continue
+            host, low, high = port_range
+            ranges[host] = ranges.get(host, ()) + ((low, high),)
+        return cls(
+            mode=FilterMode(dct['mode']),
+            values=values,
+            ranges=ranges,
+            patterns=_compile_patterns(dct.get('patterns') or []),
+            cache_size=dct.get('cache_size', DEFAULT_CACHE_SIZE),
+        )
+
+    def _decide(self, candidate: str, port: t.Optional[int]) -> bool:
+        candidate_port = f'{candidate}:{port}'
+        if candidate in self.values or candidate_port in self.values:
+            return self.mode == FilterMode.ALLOW
+        if port is not None:
+            for low, high in self.ranges.get(candidate, ()):
+                if low <= port <= high:
+                    return self.mode == FilterMode.ALLOW
+        for pattern in self.patterns:
+            if pattern.search(candidate) or pattern.search(candidate_port):
+                return self.mode == FilterMode.ALLOW
+        return self.mode == FilterMode.DENY
 
     def is_allowed(self, candidate: str, port: t.Optional[int] = None):
         """Determine if candidate is filtered based on filter mode and values"""
         if self.mode == FilterMode.NONE:
             return True
         candidate = candidate.lower()
-        candidate_port = f'{candidate}:{port}'
-        if candidate in self.values or candidate_port in self.values:
-            return self.mode == FilterMode.ALLOW
-        return self.mode == FilterMode.DENY
+        if self._cached_decide is not None:
+            return self._cached_decide(candidate, port)
+        return self._decide(candidate, port)
+
+    def cache_info(self) -> t.Optional[t.Mapping[str, int]]:
+        """Decision cache statistics, None when filter has no pattern"""
+        if self._cached_decide is None:
+            return None
+        info = self._cached_decide.cache_info()
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'max_size': info.maxsize,
+        }
@@ -1,6 +1,6 @@
 """Procksy application
 """
-from signal import signal, SIGINT, SIGTERM
+from signal import signal, SIGHUP, SIGINT, SIGTERM
 from getpass import getpass
 from argparse import ArgumentParser
 from threading import Event
@@ -12,6 +12,7 @@ from .authenticator import PASSWORD_HASHER
 
 
 TERM_EVT = Event()
+UPGRADE_EVT = Event()
 
 
 def _sigterm_handler(_signum, _frame):
@@ -20,13 +21,21 @@ def _sigterm_handler(_signum, _frame):
     TERM_EVT.set()
 
 
+def _sighup_handler(_signum, _frame):
+    LOGGER.warning("signal caught, handing over to a new process...")
+    UPGRADE_EVT.set()
+
+
 def _cmd_serve(args):
     signal(SIGINT, _sigterm_handler)
     signal(SIGTERM, _sigterm_handler)
+    signal(SIGHUP, _sighup_handler)
     config = ProcksyConfig.from_default_locations()
     config.override(args)
     LOGGER.info("configuration:\n%s", config)
-    procksy = Procksy(config=config, term_evt=TERM_EVT)
+    procksy = Procksy(
+        config=config, term_evt=TERM_EVT, upgrade_evt=UPGRADE_EVT
+    )
     procksy.serve()
 
 
@@ -60,6 +69,14 @@ def _parse_args():
         '--max-threads', type=int, help="Maximum concurrent connections"
     )
     serve.add_argument('--sock-timeout', type=int, help="Socket timeout")
+    serve.add_argument(
+        '--drain-timeout',
+        type=int,
+        help="Delay given to active tunnels to terminate on upgrade",
+    )
+    serve.add_argument(
+        '--udp-idle-timeout', type=int, help="UDP association idle timeout"
+    )
     serve.set_defaults(func=_cmd_serve)
     digest = cmd.add_parser(
         'digest', help="Generate argon2id digest for given secret"
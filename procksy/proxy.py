@@ -1,26 +1,36 @@
 """Proxy module
 """
-from time import sleep
-from threading import Event, Thread, active_count
-from dataclasses import dataclass
+import typing as t
+from time import monotonic, sleep
+from socket import SHUT_RDWR
+from threading import Event, Lock, Thread, active_count, current_thread
+from ssl import SSLContext
+from dataclasses import dataclass, field
 from .socket import (
     recv,
     proxy,
-    connect,
+    connect_error,
     sendall,
     encode_addr,
     decode_addr,
     create_socket,
     bind_and_listen,
+    CONNECT_SOCKET_OPTIONS,
+    LISTENER_SOCKET_OPTIONS,
 )
 from .config import ProcksyConfig
+from .breaker import response_for_error
 from .logging import LOGGER
+from .tls import wrap
+from .udp import UDPRelay
+from .upgrade import inherited_listener, notify_ready, spawn_successor
 from .protocol import (
     build,
     parse,
     ADDR_TYPE_IPV4,
     ADDR_TYPE_DOMAINNAME,
     COMMAND_CONNECT,
+    COMMAND_UDP_ASSOCIATE,
     METHOD_NA,
     METHOD_NO_AUTH,
     METHOD_UP_AUTH,
@@ -51,6 +61,86 @@ class Procksy:
 
     config: ProcksyConfig
     term_evt: Event
+    upgrade_evt: Event = field(default_factory=Event)
+    # client socket of each client thread, closed when drain deadline is hit
+    _clients: t.Dict[Thread, t.Any] = field(default_factory=dict)
+    _clients_lock: Lock = field(default_factory=Lock)
+    _tls_context: t.Optional[SSLContext] = None
+
+    def _create_upstream_socket(self, extra_options=None):
+        """Create a socket tuned for upstream connections
+
+        TCP Fast Open is only requested through extra_options for parent
+        proxies: connect() then returns before the SYN is sent, so a dead
+        direct target would only be detected after replying SUCCEEDED to
+        the client, whereas a dead parent fails the SOCKS handshake.
+        """
+        dest_sock = create_socket(self.config.sock_timeout)
+        if not dest_sock:
+            return None
+        if not self.config.upstream_socket_options.apply(
+            dest_sock, extra_options
+        ):
+            dest_sock.close()
+            return None
+        return dest_sock
+
+    def _connect_upstream(self, upstreams, target):
+        """Open tunnel to target through the first parent which succeeds
+
+        On success, the reply of the parent is returned to forward its
+        bound address to the client. On failure, the last failure reply
+        received from a parent is returned to be forwarded to the client.
+        """
+        dest_addr, dest_port = target
+        response = RESPONSE_SERVER_FAILURE
+        for upstream in upstreams:
+            dest_sock = self._create_upstream_socket(CONNECT_SOCKET_OPTIONS)
+            if not dest_sock:
+                return None, None, None, response
+            LOGGER.info(
+                "action=connecting target=%s parent=%s", target, upstream.name
+            )
+            start = monotonic()
+            sr_msg = upstream.open(dest_sock, dest_addr, dest_port)
+            if sr_msg and sr_msg.response == RESPONSE_SUCCEEDED:
+                self.config.upstreams.acquire(upstream, monotonic() - start)
+                return dest_sock, upstream, sr_msg, None
+            dest_sock.close()
+            if sr_msg:
+                response = sr_msg.response
+            else:
+                self.config.upstreams.mark_unhealthy(upstream)
+            LOGGER.warning(
+                "action=failover target=%s parent=%s response=%s",
+                target,
+                upstream.name,
+                sr_msg.response if sr_msg else None,
+            )
+        return None, None, None, response
+
+    def _connect_direct(self, target):
+        """Open tunnel to target directly, return socket or failure response"""
+        breaker = self.config.circuit_breaker
+        response = breaker.check(target, self.config.sock_timeout)
+        if response:
+            LOGGER.warning(
+                "action=failfast target=%s response=%s", target, response
+            )
+            return None, response
+        LOGGER.info("action=connecting target=%s", target)
+        dest_sock = self._create_upstream_socket()
+        if not dest_sock:
+            LOGGER.error("failed to create socket for target %s", target)
+            return None, RESPONSE_SERVER_FAILURE
+        error = connect_error(dest_sock, target)
+        if error:
+            dest_sock.close()
+            response = response_for_error(error)
+            breaker.record_failure(target, response)
+            return None, response
+        breaker.record_success(target)
+        return dest_sock, None
 
     def _proxy(self, client_sock, dest_addr: bytes, dest_port: int):
         payload = {
@@ -60,23 +150,33 @@ class Procksy:
             'port': 0,
         }
         target = (dest_addr, dest_port)
-        LOGGER.info("action=connecting target=%s", target)
-        dest_sock = create_socket(self.config.sock_timeout)
+        upstream = sr_msg = None
+        upstreams = self.config.upstreams.select(dest_addr, dest_port)
+        if upstreams:
+            dest_sock, upstream, sr_msg, response = self._connect_upstream(
+                upstreams, target
+            )
+        else:
+            dest_sock, response = self._connect_direct(target)
+        payload['response'] = response or RESPONSE_SERVER_FAILURE
         if not dest_sock:
-            LOGGER.error("failed to create socket for target %s", target)
-            sendall(client_sock, build(ServerReplyMessage, payload))
-            return
-        connected = connect(dest_sock, target)
-        if not connected:
             LOGGER.error("failed to connect to target %s", target)
             sendall(client_sock, build(ServerReplyMessage, payload))
             return
-        bound_addr, bound_port = dest_sock.getsockname()
         payload['response'] = RESPONSE_SUCCEEDED
-        payload['addr'] = encode_addr(bound_addr)
-        payload['port'] = bound_port
+        if sr_msg:
+            payload['addr_type'] = sr_msg.addr_type
+            payload['addr'] = sr_msg.addr
+            payload['port'] = sr_msg.port
+        else:
+            bound_addr, bound_port = dest_sock.getsockname()
+            payload['addr'] = encode_addr(bound_addr)
+            payload['port'] = bound_port
         if not sendall(client_sock, build(ServerReplyMessage, payload)):
             LOGGER.error("failed to send RESPONSE_SUCCEEDED to client")
+            dest_sock.close()
+            if upstream:
+                self.config.upstreams.release(upstream)
             return
         LOGGER.info(
             "action=proxying client=%s target=%s",
@@ -91,8 +191,51 @@ class Procksy:
             client_sock.close()
         if dest_sock != 0:
             dest_sock.close()
+        if upstream:
+            self.config.upstreams.release(upstream)
 
-    def _handle_request(self, client_sock):
+    def _target_filter(self, user):
+        """Target filter of authenticated user or global target filter"""
+        policy = self.config.authenticator.policy(user)
+        return policy or self.config.target_filter
+
+    def _associate(self, client_sock, cr_msg, user=None):
+        """Relay UDP datagrams on behalf of client"""
+        payload = {
+            'response': RESPONSE_SERVER_FAILURE,
+            'addr_type': ADDR_TYPE_IPV4,
+            'addr': bytes([0, 0, 0, 0]),
+            'port': 0,
+        }
+        client_addr, _ = client_sock.getpeername()
+        relay = UDPRelay(
+            client_sock=client_sock,
+            target_filter=self._target_filter(user),
+            idle_timeout=self.config.udp_idle_timeout,
+            term_evt=self.term_evt,
+            client_addr=(client_addr, cr_msg.port),
+        )
+        bound = relay.bind()
+        if not bound:
+            sendall(client_sock, build(ServerReplyMessage, payload))
+            return
+        bound_addr, bound_port = bound
+        payload['response'] = RESPONSE_SUCCEEDED
+        payload['addr'] = encode_addr(bound_addr)
+        payload['port'] = bound_port
+        if not sendall(client_sock, build(ServerReplyMessage, payload)):
+            LOGGER.error("failed to send RESPONSE_SUCCEEDED to client")
+            relay.udp_sock.close()
+            return
+        LOGGER.info(
+            "action=associating client=%s relay=%s",
+            client_sock.getpeername(),
+            bound,
+        )
+        relay.serve()
+        client_sock.close()
+
+    def _handle_request(self, client_sock, user=None):
         """Handle client request"""
         payload = {
             'response': RESPONSE_COMMAND_NOT_SUPPORTED,
@@ -109,6 +252,9 @@ class Procksy:
             LOGGER.error("failed to parse ClientRequestMessage")
             sendall(client_sock, build(ServerReplyMessage, payload))
             return
+        if cr_msg.command == COMMAND_UDP_ASSOCIATE:
+            self._associate(client_sock, cr_msg, user)
+            return
         if cr_msg.command != COMMAND_CONNECT:
             LOGGER.error("ClientRequestMessage command is not COMMAND_CONNECT")
             sendall(client_sock, build(ServerReplyMessage, payload))
@@ -124,7 +270,8 @@ class Procksy:
                 )
                 sendall(client_sock, build(ServerReplyMessage, payload))
                 return
-            if not self.config.target_filter.is_allowed(dest_addr, dest_port):
+            target_filter = self._target_filter(user)
+            if not target_filter.is_allowed(dest_addr, dest_port):
                 LOGGER.warning(
                     "action=denied client=%s target=%s",
                     client_sock.getpeername(),
@@ -143,38 +290,32 @@ class Procksy:
         LOGGER.error("ClientRequestMessage address type not supported")
         sendall(client_sock, build(ServerReplyMessage, payload))
 
-    def _handle_authentication(self, client_sock) -> bool:
+    def _handle_authentication(self, client_sock) -> t.Optional[bytes]:
+        """Authenticate client, return username on success"""
         payload = {'status': STATUS_FAILURE}
         cba_msg_data = recv(client_sock, self.config.buffer_size)
         if not cba_msg_data:
             LOGGER.error("client connection closed")
-            return False
+            return None
         cba_msg = parse(ClientBasicAuthMessage, cba_msg_data)
         if not cba_msg:
             LOGGER.error("failed to parse ClientBasicAuthMessage")
             sendall(client_sock, build(ServerBasicAuthStatusMessage, payload))
-            return False
+            return None
         if not self.config.authenticator.is_allowed(
             cba_msg.username.value, cba_msg.password.value
         ):
             sendall(client_sock, build(ServerBasicAuthStatusMessage, payload))
-            return False
+            return None
         payload['status'] = STATUS_SUCCESS
         sendall(client_sock, build(ServerBasicAuthStatusMessage, payload))
-        return True
+        return cba_msg.username.value
 
     def _handle_method_selection(self, client_sock):
         """Handle protocol version and authentication method negociation"""
         payload = {
             'method': METHOD_NA,
         }
-        peer_addr, _ = client_sock.getpeername()
-        if not self.config.client_filter.is_allowed(peer_addr):
-            LOGGER.warning(
-                "action=denied client=%s", client_sock.getpeername()
-            )
-            sendall(client_sock, build(ServerMethodSelectionMessage, payload))
-            return METHOD_NA
         cms_msg_data = recv(client_sock, self.config.buffer_size)
         if not cms_msg_data:
             LOGGER.error("client connection closed")
@@ -210,34 +351,169 @@ class Procksy:
         sendall(client_sock, build(ServerMethodSelectionMessage, payload))
         return METHOD_NA
 
+    def _handle_client_filter(self, client_sock) -> bool:
+        """Deny filtered clients before any handshake"""
+        peer_addr, _ = client_sock.getpeername()
+        if self.config.client_filter.is_allowed(peer_addr):
+            return True
+        LOGGER.warning("action=denied client=%s", client_sock.getpeername())
+        if self._tls_context:
+            client_sock.close()
+            return False
+        payload = {
+            'method': METHOD_NA,
+        }
+        sendall(client_sock, build(ServerMethodSelectionMessage, payload))
+        return False
+
     def _handle_client(self, client_sock):
         """Handle SOCKS proxy client"""
+        if not self._handle_client_filter(client_sock):
+            return
+        if self._tls_context:
+            client_sock = wrap(
+                self._tls_context, client_sock, self.config.sock_timeout
+            )
+            if not client_sock:
+                return
+            with self._clients_lock:
+                self._clients[current_thread()] = client_sock
         method = self._handle_method_selection(client_sock)
         if method == METHOD_NA:
             return
+        user = None
         if method == METHOD_UP_AUTH:
-            if not self._handle_authentication(client_sock):
+            user = self._handle_authentication(client_sock)
+            if user is None:
                 return
-        self._handle_request(client_sock)
+        self._handle_request(client_sock, user)
+
+    def _listen(self):
+        """Inherit listening socket from previous process or create it"""
+        listener = inherited_listener(self.config.sock_timeout)
+        if listener:
+            self.config.client_socket_options.apply(
+                listener, LISTENER_SOCKET_OPTIONS
+            )
+            return listener
+        listener = create_socket(self.config.sock_timeout)
+        if not listener:
+            return None
+        if not self.config.client_socket_options.apply(
+            listener, LISTENER_SOCKET_OPTIONS
+        ):
+            listener.close()
+            return None
+        if not bind_and_listen(
+            listener, self.config.bind_addr, self.config.bind_port
+        ):
+            return None
+        return listener
+
+    def _prune_clients(self):
+        with self._clients_lock:
+            self._clients = {
+                thread: client_sock
+                for thread, client_sock in self._clients.items()
+                if thread.is_alive()
+            }
+
+    def _drain(self):
+        """Wait for active tunnels to terminate until drain deadline
+
+        Client sockets still open at the deadline are shut down to wake up
+        threads blocked in recv, whatever the SOCKS phase they are in.
+        """
+        deadline = monotonic() + self.config.drain_timeout
+        for client_thread in list(self._clients):
+            remaining = deadline - monotonic()
+            if remaining <= 0 or self.term_evt.is_set():
+                break
+            client_thread.join(remaining)
+        self.term_evt.set()
+        self._prune_clients()
+        if not self._clients:
+            return
+        LOGGER.warning(
+            "drain deadline reached, closing %d tunnel(s)", len(self._clients)
+        )
+        for client_sock in self._clients.values():
+            try:
+                client_sock.shutdown(SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _report_socket_options(self, listener):
+        """Log effective socket options for both sides"""
+        LOGGER.info(
+            "listener socket options: %s",
+            self.config.client_socket_options.effective(
+                listener, LISTENER_SOCKET_OPTIONS
+            ),
+        )
+        dest_sock = self._create_upstream_socket(CONNECT_SOCKET_OPTIONS)
+        if not dest_sock:
+            return
+        LOGGER.info(
+            "upstream socket options (fastopen for parent proxies only): %s",
+            self.config.upstream_socket_options.effective(
+                dest_sock, CONNECT_SOCKET_OPTIONS
+            ),
+        )
+        dest_sock.close()
+
+    def _report_filter_cache(self):
+        """Log target filters decision cache statistics"""
+        filters = {'target_filter': self.config.target_filter}
+        for name, policy in self.config.authenticator.named_policies.items():
+            filters[f'policy[{name}]'] = policy
+        for name, target_filter in filters.items():
+            cache_info = target_filter.cache_info()
+            if cache_info:
+                LOGGER.info("%s cache: %s", name, cache_info)
 
     def serve(self):
         """Start serving clients"""
-        new_client_sock = create_socket(self.config.sock_timeout)
-        bind_and_listen(
-            new_client_sock, self.config.bind_addr, self.config.bind_port
+        if self.config.tls.enabled:
+            self._tls_context = self.config.tls.create_context()
+            if not self._tls_context:
+                return
+        new_client_sock = self._listen()
+        if not new_client_sock:
+            return
+        self.config.upstreams.start_health_check(
+            self.term_evt, self.config.sock_timeout
         )
         LOGGER.info(
             "serving on %s:%d",
             self.config.bind_addr,
             self.config.bind_port,
         )
+        self._report_socket_options(new_client_sock)
+        notify_ready()
+        successor = None
         while not self.term_evt.is_set():
+            if self.upgrade_evt.is_set():
+                self.upgrade_evt.clear()
+                if successor is None:
+                    successor = spawn_successor(new_client_sock)
+            if successor is not None:
+                # keep accepting until successor serves the listener
+                ready = successor.poll()
+                if ready:
+                    new_client_sock.close()
+                    self._drain()
+                    self._report_filter_cache()
+                    return
+                if ready is False:
+                    successor = None
             if active_count() > self.config.max_threads:
                 sleep(3)
                 continue
             try:
                 client_sock, _ = new_client_sock.accept()
                 client_sock.setblocking(1)
+                self.config.client_socket_options.apply(client_sock)
             except TimeoutError:
                 continue
             except OSError:
@@ -249,5 +525,9 @@ class Procksy:
             client_thread = Thread(
                 target=self._handle_client, args=(client_sock,)
             )
+            self._prune_clients()
+            with self._clients_lock:
+                self._clients[client_thread] = client_sock
             client_thread.start()
         new_client_sock.close()
+        self._report_filter_cache()
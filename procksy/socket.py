@@ -1,19 +1,122 @@
 """Socket module
 """
+import socket as _socket
 import typing as t
+from sys import platform
+from ssl import SSLSocket
 from select import select
 from socket import (
     AF_INET,
     SOL_SOCKET,
     SOCK_STREAM,
+    IPPROTO_TCP,
     SO_REUSEADDR,
+    SO_KEEPALIVE,
+    SO_RCVBUF,
+    SO_SNDBUF,
+    TCP_NODELAY,
     socket,
     inet_pton,
     inet_ntop,
 )
+from dataclasses import dataclass, fields
 from .logging import LOGGER
 
 
+# missing from socket module on some python versions
+TCP_FASTOPEN_CONNECT = getattr(
+    _socket, 'TCP_FASTOPEN_CONNECT', 30 if platform == 'linux' else None
+)
+# option name: (level, optname), optname is None when not supported
+SOCKET_OPTIONS = {
+    'tcp_nodelay': (IPPROTO_TCP, TCP_NODELAY),
+    'keepalive': (SOL_SOCKET, SO_KEEPALIVE),
+    'keepalive_idle': (IPPROTO_TCP, getattr(_socket, 'TCP_KEEPIDLE', None)),
+    'keepalive_interval': (
+        IPPROTO_TCP,
+        getattr(_socket, 'TCP_KEEPINTVL', None),
+    ),
+    'keepalive_count': (IPPROTO_TCP, getattr(_socket, 'TCP_KEEPCNT', None)),
+    'rcvbuf': (SOL_SOCKET, SO_RCVBUF),
+    'sndbuf': (SOL_SOCKET, SO_SNDBUF),
+    'user_timeout': (
+        IPPROTO_TCP,
+        getattr(_socket, 'TCP_USER_TIMEOUT', None),
+    ),
+}
+LISTENER_SOCKET_OPTIONS = {
+    'defer_accept': (
+        IPPROTO_TCP,
+        getattr(_socket, 'TCP_DEFER_ACCEPT', None),
+    ),
+    'fastopen': (IPPROTO_TCP, getattr(_socket, 'TCP_FASTOPEN', None)),
+}
+CONNECT_SOCKET_OPTIONS = {
+    'fastopen': (IPPROTO_TCP, TCP_FASTOPEN_CONNECT),
+}
+
+
+@dataclass
+class SocketOptions:
+    """TCP socket options applied to one side of tunnels, None to skip"""
+
+    tcp_nodelay: t.Optional[bool] = None
+    keepalive: t.Optional[bool] = None
+    keepalive_idle: t.Optional[int] = None
+    keepalive_interval: t.Optional[int] = None
+    keepalive_count: t.Optional[int] = None
+    rcvbuf: t.Optional[int] = None
+    sndbuf: t.Optional[int] = None
+    user_timeout: t.Optional[int] = None
+    defer_accept: t.Optional[int] = None
+    fastopen: t.Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, dct):
+        """Build instance from dict"""
+        return cls(
+            **{
+                option.name: dct[option.name]
+                for option in fields(cls)
+                if option.name in dct
+            }
+        )
+
+    def _options(self, extra_options):
+        options = dict(SOCKET_OPTIONS)
+        options.update(extra_options or {})
+        for name, (level, optname) in options.items():
+            value = getattr(self, name)
+            if value is None:
+                continue
+            yield name, level, optname, int(value)
+
+    def apply(self, sock, extra_options=None) -> bool:
+        """Apply options to socket, extra options depend on socket role"""
+        for name, level, optname, value in self._options(extra_options):
+            if optname is None:
+                LOGGER.warning("socket option not supported: %s", name)
+                continue
+            try:
+                sock.setsockopt(level, optname, value)
+            except OSError:
+                LOGGER.exception("setsockopt failed: %s=%d", name, value)
+                return False
+        return True
+
+    def effective(self, sock, extra_options=None) -> t.Dict[str, int]:
+        """Effective values of applied options read back from socket"""
+        values = {}
+        for name, level, optname, _ in self._options(extra_options):
+            if optname is None:
+                continue
+            try:
+                values[name] = sock.getsockopt(level, optname)
+            except OSError:
+                LOGGER.exception("getsockopt failed: %s", name)
+        return values
+
+
 def create_socket(timeout: int):
     """Create an INET, STREAMing socket"""
     try:
@@ -43,14 +146,19 @@ def bind_and_listen(sock, addr: str, port: int) -> bool:
     return True
 
 
-def connect(sock, peer_name: t.Tuple[bytes, int]):
-    """Connect to desired destination"""
+def connect_error(sock, peer_name: t.Tuple[bytes, int]) -> t.Optional[OSError]:
+    """Connect to desired destination, return error on failure"""
     try:
         sock.connect(peer_name)
-    except OSError:
+    except OSError as exc:
         LOGGER.exception("connect failed")
-        return False
-    return True
+        return exc
+    return None
+
+
+def connect(sock, peer_name: t.Tuple[bytes, int]):
+    """Connect to desired destination"""
+    return connect_error(sock, peer_name) is None
 
 
 def sendall(sock, data: bytes) -> bool:
@@ -77,6 +185,17 @@ def recv(sock, buffer_size: int) -> t.Optional[bytes]:
     return data
 
 
+def recv_exact(sock, size: int) -> t.Optional[bytes]:
+    """Receive exactly size bytes, None if connection ends before"""
+    data = b''
+    while len(data) < size:
+        chunk = recv(sock, size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
 def send(sock, data: bytes) -> bool:
     """Send data"""
     try:
@@ -91,8 +210,15 @@ def send(sock, data: bytes) -> bool:
 
 def proxy(client_sock, dest_sock, buffer_size: int) -> bool:
     """Forward data between peers"""
+    # TLS records already decrypted by the SSL layer do not wake select
+    reader = [
+        sock
+        for sock in (client_sock, dest_sock)
+        if isinstance(sock, SSLSocket) and sock.pending()
+    ]
     try:
-        reader, _, _ = select([client_sock, dest_sock], [], [], 1)
+        if not reader:
+            reader, _, _ = select([client_sock, dest_sock], [], [], 1)
     except OSError:
         LOGGER.exception("select failed")
         return False
@@ -0,0 +1,96 @@
+"""TLS module
+"""
+import typing as t
+from time import monotonic
+from ssl import (
+    PROTOCOL_TLS_SERVER,
+    SSLContext,
+    SSLError,
+    SSLWantReadError,
+    SSLWantWriteError,
+)
+from select import select
+from dataclasses import dataclass
+from .logging import LOGGER
+
+
+DEFAULT_NUM_TICKETS = 2
+
+
+@dataclass
+class TLSConfig:
+    """TLS listener configuration"""
+
+    enabled: bool = False
+    certfile: t.Optional[str] = None
+    keyfile: t.Optional[str] = None
+    num_tickets: int = DEFAULT_NUM_TICKETS
+
+    @classmethod
+    def from_dict(cls, dct):
+        """Build instance from dict"""
+        return cls(
+            enabled=dct.get('enabled', False),
+            certfile=dct.get('certfile'),
+            keyfile=dct.get('keyfile'),
+            num_tickets=dct.get('num_tickets', DEFAULT_NUM_TICKETS),
+        )
+
+    def create_context(self) -> t.Optional[SSLContext]:
+        """Create server context with session resumption enabled"""
+        try:
+            context = SSLContext(PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(self.certfile, self.keyfile)
+            # session tickets (TLS 1.3 and 1.2), session ids are cached by
+            # OpenSSL server session cache which is enabled by default
+            context.num_tickets = self.num_tickets
+        except (OSError, SSLError, ValueError):
+            LOGGER.exception("failed to create TLS context")
+            return None
+        return context
+
+
+def _handshake(tls_sock, deadline: float) -> bool:
+    """Perform handshake on non-blocking socket until deadline"""
+    while True:
+        try:
+            tls_sock.do_handshake()
+            return True
+        except SSLWantReadError:
+            readers, writers = [tls_sock], []
+        except SSLWantWriteError:
+            readers, writers = [], [tls_sock]
+        remaining = deadline - monotonic()
+        if remaining <= 0:
+            return False
+        select(readers, writers, [], remaining)
+
+
+def wrap(context: SSLContext, client_sock, timeout: int):
+    """Perform server side TLS handshake bounded by timeout"""
+    peer_name = client_sock.getpeername()
+    start = monotonic()
+    tls_sock = None
+    try:
+        client_sock.setblocking(False)
+        tls_sock = context.wrap_socket(
+            client_sock, server_side=True, do_handshake_on_connect=False
+        )
+        if not _handshake(tls_sock, start + timeout):
+            LOGGER.error("TLS handshake timed out for client %s", peer_name)
+            tls_sock.close()
+            return None
+        tls_sock.setblocking(True)
+    except (OSError, SSLError):
+        LOGGER.exception("TLS handshake failed for client %s", peer_name)
+        # client_sock is detached once wrapped, closing it would be a no-op
+        (tls_sock or client_sock).close()
+        return None
+    LOGGER.info(
+        "action=tls_handshake client=%s version=%s resumed=%s duration=%.3f",
+        peer_name,
+        tls_sock.version(),
+        tls_sock.session_reused,
+        monotonic() - start,
+    )
+    return tls_sock
@@ -0,0 +1,194 @@
+"""UDP module
+"""
+import typing as t
+from time import monotonic
+from struct import pack_into, unpack_from
+from select import select
+from socket import (
+    AF_INET,
+    SOCK_DGRAM,
+    gaierror,
+    socket,
+    inet_aton,
+    inet_ntop,
+    getaddrinfo,
+)
+from threading import Event
+from dataclasses import dataclass, field
+from .filter import Filter
+from .socket import recv
+from .logging import LOGGER
+
+
+# UDP Request Header
+# +----+------+------+----------+----------+----------+
+# |RSV | FRAG | ATYP | DST.ADDR | DST.PORT |   DATA   |
+# +----+------+------+----------+----------+----------+
+UDP_ATYP_IPV4 = 0x01
+UDP_ATYP_DOMAINNAME = 0x03
+UDP_HEADER_MIN_SIZE = 4
+UDP_HEADER_IPV4_SIZE = 10
+UDP_BUFFER_SIZE = 65535
+MAX_CACHED_DESTINATIONS = 1024
+
+
+def _header_size(view: memoryview, size: int) -> int:
+    """Size of UDP request header found in view, 0 when unsupported"""
+    if size < UDP_HEADER_MIN_SIZE or view[0] or view[1] or view[2]:
+        return 0
+    atyp = view[3]
+    if atyp == UDP_ATYP_IPV4:
+        header_size = UDP_HEADER_IPV4_SIZE
+    elif atyp == UDP_ATYP_DOMAINNAME and size > UDP_HEADER_MIN_SIZE:
+        header_size = 7 + view[4]
+    else:
+        return 0
+    return header_size if size >= header_size else 0
+
+
+def _decode_destination(view: memoryview, header_size: int):
+    """Decode destination address and port, None address if undecodable"""
+    (port,) = unpack_from('!H', view, header_size - 2)
+    if view[3] == UDP_ATYP_IPV4:
+        return inet_ntop(AF_INET, view[4:8]), port
+    try:
+        return bytes(view[5 : header_size - 2]).decode('utf-8'), port
+    except UnicodeDecodeError:
+        return None, port
+
+
+@dataclass
+class UDPRelay:
+    """Relay datagrams between a client and its targets"""
+
+    client_sock: t.Any
+    target_filter: Filter
+    idle_timeout: int
+    term_evt: Event
+    udp_sock: t.Any = None
+    client_addr: t.Optional[t.Tuple[str, int]] = None
+    _destinations: t.Dict[bytes, t.Any] = field(default_factory=dict)
+    _headers: t.Dict[t.Tuple[str, int], bytes] = field(default_factory=dict)
+
+    def bind(self) -> t.Optional[t.Tuple[str, int]]:
+        """Bind relay socket on the interface used by client"""
+        try:
+            self.udp_sock = socket(AF_INET, SOCK_DGRAM)
+            self.udp_sock.bind((self.client_sock.getsockname()[0], 0))
+        except OSError:
+            LOGGER.exception("udp bind failed")
+            if self.udp_sock:
+                self.udp_sock.close()
+            return None
+        return self.udp_sock.getsockname()
+
+    def _cache(self, key: bytes, sockaddr):
+        if len(self._destinations) >= MAX_CACHED_DESTINATIONS:
+            self._destinations.clear()
+            self._headers.clear()
+        self._destinations[key] = sockaddr
+        if sockaddr and sockaddr not in self._headers:
+            header = bytearray(UDP_HEADER_IPV4_SIZE)
+            pack_into(
+                '!HBB4sH',
+                header,
+                0,
+                0,
+                0,
+                UDP_ATYP_IPV4,
+                inet_aton(sockaddr[0]),
+                sockaddr[1],
+            )
+            self._headers[sockaddr] = bytes(header)
+
+    def _resolve(self, view: memoryview, header_size: int):
+        """Cached filter decision and resolved address for destination
+
+        The cache key is a copy of the address part of the header (at most
+        262 bytes), the only allocation made for datagrams of a known
+        destination.
+        """
+        key = bytes(view[3:header_size])
+        try:
+            return self._destinations[key]
+        except KeyError:
+            pass
+        dest_addr, dest_port = _decode_destination(view, header_size)
+        sockaddr = None
+        if dest_addr is None:
+            LOGGER.warning(
+                "action=denied client=%s protocol=udp error=decode_addr_failed",
+                self.client_addr,
+            )
+        elif self.target_filter.is_allowed(dest_addr, dest_port):
+            try:
+                sockaddr = getaddrinfo(
+                    dest_addr, dest_port, AF_INET, SOCK_DGRAM
+                )[0][4]
+            except (gaierror, UnicodeError):
+                LOGGER.error("failed to resolve udp target %s", dest_addr)
+        else:
+            LOGGER.warning(
+                "action=denied client=%s target=%s protocol=udp",
+                self.client_addr,
+                (dest_addr, dest_port),
+            )
+        self._cache(key, sockaddr)
+        return sockaddr
+
+    def _from_client(self, view: memoryview):
+        header_size = _header_size(view, len(view))
+        if not header_size:
+            return
+        sockaddr = self._resolve(view, header_size)
+        if sockaddr:
+            self.udp_sock.sendto(view[header_size:], sockaddr)
+
+    def _relay(self, buffer: bytearray, view: memoryview):
+        """Forward one datagram, received after room for a reply header"""
+        size, sockaddr = self.udp_sock.recvfrom_into(
+            view[UDP_HEADER_IPV4_SIZE:]
+        )
+        end = UDP_HEADER_IPV4_SIZE + size
+        if sockaddr[0] == self.client_addr[0]:
+            if self.client_addr[1] == 0:
+                self.client_addr = sockaddr
+            if sockaddr == self.client_addr:
+                self._from_client(view[UDP_HEADER_IPV4_SIZE:end])
+                return
+        header = self._headers.get(sockaddr)
+        if header is None:
+            return
+        buffer[:UDP_HEADER_IPV4_SIZE] = header
+        self.udp_sock.sendto(view[:end], self.client_addr)
+
+    def serve(self):
+        """Relay datagrams until client disconnects or association idles"""
+        buffer = bytearray(UDP_HEADER_IPV4_SIZE + UDP_BUFFER_SIZE)
+        view = memoryview(buffer)
+        last_activity = monotonic()
+        while not self.term_evt.is_set():
+            try:
+                reader, _, _ = select(
+                    [self.client_sock, self.udp_sock], [], [], 1
+                )
+            except OSError:
+                LOGGER.exception("select failed")
+                break
+            if not reader:
+                if monotonic() - last_activity > self.idle_timeout:
+                    LOGGER.info(
+                        "action=idle client=%s protocol=udp", self.client_addr
+                    )
+                    break
+                continue
+            if self.client_sock in reader:
+                if not recv(self.client_sock, 1):
+                    break
+            if self.udp_sock in reader:
+                last_activity = monotonic()
+                try:
+                    self._relay(buffer, view)
+                except OSError:
+                    LOGGER.exception("udp relay failed")
+        self.udp_sock.close()
@@ -0,0 +1,106 @@
+"""Upgrade module
+"""
+import typing as t
+from os import close, environ, pipe, read, write
+from sys import argv, executable
+from time import monotonic
+from select import select
+from socket import AF_INET, SOCK_STREAM, socket
+from subprocess import Popen
+from dataclasses import dataclass
+from .logging import LOGGER
+
+
+LISTEN_FD_ENV = 'PROCKSY_LISTEN_FD'
+READY_FD_ENV = 'PROCKSY_READY_FD'
+READY = b'\x01'
+READY_TIMEOUT = 30
+
+
+@dataclass
+class Successor:
+    """Process taking over the listening socket"""
+
+    process: Popen
+    ready_fd: int
+    deadline: float
+
+    def _abort(self, reason: str) -> bool:
+        LOGGER.error(
+            "successor process pid=%d %s, handover cancelled",
+            self.process.pid,
+            reason,
+        )
+        close(self.ready_fd)
+        if self.process.poll() is None:
+            self.process.terminate()
+        return False
+
+    def poll(self) -> t.Optional[bool]:
+        """True once successor is ready, False if it failed, None meanwhile"""
+        readable, _, _ = select([self.ready_fd], [], [], 0)
+        if readable:
+            if read(self.ready_fd, 1) != READY:
+                return self._abort("exited before being ready")
+            close(self.ready_fd)
+            LOGGER.info("successor process pid=%d ready", self.process.pid)
+            return True
+        if self.process.poll() is not None:
+            return self._abort("exited before being ready")
+        if monotonic() > self.deadline:
+            return self._abort("not ready in time")
+        return None
+
+
+def inherited_listener(timeout: int):
+    """Retrieve listening socket inherited from previous process if any"""
+    value = environ.pop(LISTEN_FD_ENV, None)
+    if value is None:
+        return None
+    try:
+        sock = socket(AF_INET, SOCK_STREAM, fileno=int(value))
+        sock.settimeout(timeout)
+    except (ValueError, OSError):
+        LOGGER.exception("failed to inherit listening socket fd=%s", value)
+        return None
+    LOGGER.info("inherited listening socket fd=%d", sock.fileno())
+    return sock
+
+
+def notify_ready():
+    """Tell previous process that the inherited listener is served"""
+    value = environ.pop(READY_FD_ENV, None)
+    if value is None:
+        return
+    try:
+        write(int(value), READY)
+        close(int(value))
+    except (ValueError, OSError):
+        LOGGER.exception("failed to notify readiness fd=%s", value)
+
+
+def spawn_successor(listener) -> t.Optional[Successor]:
+    """Start a new process inheriting the listening socket"""
+    fd = listener.fileno()
+    ready_fd, notify_fd = pipe()
+    env = dict(environ)
+    env[LISTEN_FD_ENV] = str(fd)
+    env[READY_FD_ENV] = str(notify_fd)
+    try:
+        process = Popen(
+            [executable, '-m', 'procksy.main', *argv[1:]],
+            env=env,
+            pass_fds=(fd, notify_fd),
+        )
+    except OSError:
+        LOGGER.exception("failed to spawn successor process")
+        close(ready_fd)
+        return None
+    finally:
+        close(notify_fd)
+    LOGGER.info("spawned successor process pid=%d", process.pid)
+    return Successor(
+        process=process,
+        ready_fd=ready_fd,
+        deadline=monotonic() + READY_TIMEOUT,
+    )
@@ -0,0 +1,285 @@
+"""Upstream module
+"""
+import typing as t
+from enum import Enum
+from time import monotonic
+from threading import Event, Lock, Thread
+from dataclasses import dataclass, field
+from .filter import Filter, FilterMode
+from .socket import (
+    recv,
+    connect,
+    sendall,
+    recv_exact,
+    encode_addr,
+    create_socket,
+)
+from .logging import LOGGER
+from .protocol import (
+    build,
+    parse,
+    ADDR_TYPE_IPV4,
+    ADDR_TYPE_DOMAINNAME,
+    COMMAND_CONNECT,
+    METHOD_NO_AUTH,
+    METHOD_UP_AUTH,
+    STATUS_SUCCESS,
+    ServerReplyMessage,
+    ClientRequestMessage,
+    ServerMethodSelectionMessage,
+    ClientMethodSelectionMessage,
+    ClientBasicAuthMessage,
+    ServerBasicAuthStatusMessage,
+)
+
+
+class Balancing(Enum):
+    """Balancing strategy"""
+
+    LEAST_CONNECTIONS = 'least_connections'
+    LATENCY = 'latency'
+
+
+DEFAULT_BALANCING = Balancing.LEAST_CONNECTIONS
+DEFAULT_HEALTH_CHECK_INTERVAL = 10
+LATENCY_SMOOTHING = 0.2
+# server reply size without BND.ADDR, then BND.ADDR size for each ATYP
+# except DOMAINNAME which is prefixed by its size
+REPLY_HEADER_SIZE = 4
+REPLY_PORT_SIZE = 2
+REPLY_ATYP_DOMAINNAME = 0x03
+REPLY_ADDR_SIZES = {0x01: 4, 0x04: 16}
+
+
+@dataclass
+class Upstream:
+    """Upstream SOCKS5 parent proxy"""
+
+    name: str
+    addr: str
+    port: int
+    username: t.Optional[bytes] = None
+    password: t.Optional[bytes] = field(default=None, repr=False)
+    healthy: bool = True
+    active: int = 0
+    latency: float = 0.0
+
+    @classmethod
+    def from_dict(cls, name, dct):
+        """Build instance from dict"""
+        username = dct.get('username')
+        password = dct.get('password')
+        if bool(username) != bool(password):
+            raise ValueError(
+                f"parent {name} requires both username and password"
+            )
+        return cls(
+            name=name,
+            addr=dct['addr'],
+            port=dct['port'],
+            username=username.encode('utf-8') if username else None,
+            password=password.encode('utf-8') if password else None,
+        )
+
+    def _authenticate(self, sock) -> bool:
+        methods = [METHOD_UP_AUTH] if self.username else [METHOD_NO_AUTH]
+        payload = {'nmethods': len(methods), 'methods': methods}
+        if not sendall(sock, build(ClientMethodSelectionMessage, payload)):
+            return False
+        sms_msg = parse(ServerMethodSelectionMessage, recv(sock, 2) or b'')
+        if not sms_msg or sms_msg.method not in methods:
+            LOGGER.error("parent %s rejected authentication method", self.name)
+            return False
+        if sms_msg.method == METHOD_NO_AUTH:
+            return True
+        payload = {
+            'username': {'size': len(self.username), 'value': self.username},
+            'password': {'size': len(self.password), 'value': self.password},
+        }
+        if not sendall(sock, build(ClientBasicAuthMessage, payload)):
+            return False
+        sbas_msg = parse(ServerBasicAuthStatusMessage, recv(sock, 2) or b'')
+        if not sbas_msg or sbas_msg.status != STATUS_SUCCESS:
+            LOGGER.error("parent %s authentication failure", self.name)
+            return False
+        return True
+
+    def _reply(self, sock):
+        """Read exactly one server reply, leaving target data in socket"""
+        header = recv_exact(sock, REPLY_HEADER_SIZE)
+        if not header:
+            return None
+        if header[3] == REPLY_ATYP_DOMAINNAME:
+            addr_size = recv_exact(sock, 1)
+            if not addr_size:
+                return None
+            header += addr_size
+            size = addr_size[0] + REPLY_PORT_SIZE
+        else:
+            size = REPLY_ADDR_SIZES.get(header[3], 0) + REPLY_PORT_SIZE
+        data = recv_exact(sock, size)
+        if not data:
+            return None
+        return parse(ServerReplyMessage, header + data)
+
+    def _request(self, sock, dest_addr: str, dest_port: int):
+        try:
+            payload = {
+                'command': COMMAND_CONNECT,
+                'addr_type': ADDR_TYPE_IPV4,
+                'addr': encode_addr(dest_addr),
+                'port': dest_port,
+            }
+        except OSError:
+            encoded = dest_addr.encode('utf-8')
+            payload = {
+                'command': COMMAND_CONNECT,
+                'addr_type': ADDR_TYPE_DOMAINNAME,
+                'addr': {'size': len(encoded), 'value': encoded},
+                'port': dest_port,
+            }
+        if not sendall(sock, build(ClientRequestMessage, payload)):
+            return None
+        return self._reply(sock)
+
+    def handshake(self, sock) -> bool:
+        """Connect to parent and negociate authentication method"""
+        if not connect(sock, (self.addr, self.port)):
+            return False
+        return self._authenticate(sock)
+
+    def open(self, sock, dest_addr: str, dest_port: int):
+        """Open a tunnel to target through parent, return reply message"""
+        if not self.handshake(sock):
+            return None
+        return self._request(sock, dest_addr, dest_port)
+
+
+@dataclass
+class UpstreamRoute:
+    """Targets routed through a given set of parents"""
+
+    targets: Filter
+    parents: t.List[str]
+
+    @classmethod
+    def from_dict(cls, dct):
+        """Build instance from dict"""
+        return cls(
+            targets=Filter.from_dict(
+                {
+                    'mode': FilterMode.ALLOW.value,
+                    'values': dct.get('values'),
+                    'filepath': dct.get('filepath'),
+                }
+            ),
+            parents=dct['parents'],
+        )
+
+
+@dataclass
+class UpstreamPool:
+    """Pool of upstream SOCKS5 parent proxies"""
+
+    parents: t.Mapping[str, Upstream] = field(default_factory=dict)
+    routes: t.List[UpstreamRoute] = field(default_factory=list)
+    default: t.List[str] = field(default_factory=list)
+    balancing: Balancing = DEFAULT_BALANCING
+    health_check_interval: int = DEFAULT_HEALTH_CHECK_INTERVAL
+    _lock: Lock = field(default_factory=Lock, repr=False)
+
+    @classmethod
+    def from_dict(cls, dct):
+        """Build instance from dict"""
+        return cls(
+            parents={
+                name: Upstream.from_dict(name, parent)
+                for name, parent in dct.get('parents', {}).items()
+            },
+            routes=[
+                UpstreamRoute.from_dict(route)
+                for route in dct.get('routes', [])
+            ],
+            default=dct.get('default', []),
+            balancing=Balancing(dct.get('balancing', DEFAULT_BALANCING.value)),
+            health_check_interval=dct.get(
+                'health_check_interval', DEFAULT_HEALTH_CHECK_INTERVAL
+            ),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        """Determine if at least one parent is configured"""
+        return bool(self.parents)
+
+    def _key(self, upstream: Upstream):
+        if self.balancing == Balancing.LATENCY:
+            weight = upstream.latency * (upstream.active + 1)
+            return (not upstream.healthy, weight)
+        return (not upstream.healthy, upstream.active, upstream.latency)
+
+    def select(self, dest_addr: str, dest_port: int) -> t.List[Upstream]:
+        """Parents to try in order for given target, empty means direct"""
+        names = self.default
+        for route in self.routes:
+            if route.targets.is_allowed(dest_addr, dest_port):
+                names = route.parents
+                break
+        upstreams = [
+            self.parents[name] for name in names if name in self.parents
+        ]
+        with self._lock:
+            return sorted(upstreams, key=self._key)
+
+    def acquire(self, upstream: Upstream, latency: float):
+        """Account for a new tunnel established through parent"""
+        with self._lock:
+            upstream.healthy = True
+            upstream.active += 1
+            upstream.latency += LATENCY_SMOOTHING * (
+                latency - upstream.latency
+            )
+
+    def release(self, upstream: Upstream):
+        """Account for a tunnel closed through parent"""
+        with self._lock:
+            upstream.active -= 1
+
+    def mark_unhealthy(self, upstream: Upstream):
+        """Push parent to the end of selection until next health check"""
+        with self._lock:
+            upstream.healthy = False
+
+    def _health_check(self, sock_timeout: int):
+        for upstream in self.parents.values():
+            sock = create_socket(sock_timeout)
+            if not sock:
+                continue
+            start = monotonic()
+            healthy = upstream.handshake(sock)
+            latency = monotonic() - start
+            sock.close()
+            with self._lock:
+                if healthy != upstream.healthy:
+                    LOGGER.warning(
+                        "parent %s healthy=%s", upstream.name, healthy
+                    )
+                upstream.healthy = healthy
+                if healthy:
+                    upstream.latency += LATENCY_SMOOTHING * (
+                        latency - upstream.latency
+                    )
+
+    def _health_check_loop(self, term_evt: Event, sock_timeout: int):
+        while not term_evt.wait(self.health_check_interval):
+            self._health_check(sock_timeout)
+
+    def start_health_check(self, term_evt: Event, sock_timeout: int):
+        """Periodically check parents in a background thread"""
+        if not self.enabled or self.health_check_interval <= 0:
+            return
+        Thread(
+            target=self._health_check_loop,
+            args=(term_evt, sock_timeout),
+            daemon=True,
+        ).start()